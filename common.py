@@ -0,0 +1,275 @@
+import csv
+import functools
+import json
+import os
+import sys
+
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_shared = set()
+_sheet_tabs = {}
+
+COST_CSV_HEADER = [
+    "account_id",
+    "account_name",
+    "period_start",
+    "period_end",
+    "granularity",
+    "service",
+    "amount",
+    "unit",
+]
+
+
+@functools.lru_cache(maxsize=None)
+def _get_services(gcp_key_path):
+    scopes = [
+        "https://www.googleapis.com/auth/spreadsheets",
+        "https://www.googleapis.com/auth/drive",
+    ]
+    credentials = service_account.Credentials.from_service_account_file(
+        gcp_key_path, scopes=scopes
+    )
+    # Use the discovery documents bundled with google-api-python-client
+    # instead of fetching them over HTTP.
+    sheets_service = build(
+        "sheets",
+        "v4",
+        credentials=credentials,
+        cache_discovery=False,
+        static_discovery=True,
+    )
+    drive_service = build(
+        "drive",
+        "v3",
+        credentials=credentials,
+        cache_discovery=False,
+        static_discovery=True,
+    )
+    return sheets_service, drive_service
+
+
+def upload_csv_to_google_sheet(
+    csv_path,
+    gcp_key_path,
+    sheet_id=None,
+    sheet_title="AWS Cost Analyzer",
+    sheet_tab="Sheet1",
+    share_with=None,
+    clear_existing=True,
+    rows=None,
+):
+    if (csv_path is None) == (rows is None):
+        raise ValueError("Provide exactly one of csv_path or rows.")
+
+    if csv_path is not None:
+        with open(csv_path, "r", encoding="utf-8") as csvfile:
+            rows = list(csv.reader(csvfile))
+
+    return upload_tabs_to_google_sheet(
+        gcp_key_path,
+        [(sheet_tab, rows, clear_existing)],
+        sheet_id=sheet_id,
+        sheet_title=sheet_title,
+        share_with=share_with,
+    )
+
+
+def upload_tabs_to_google_sheet(
+    gcp_key_path,
+    tabs,
+    sheet_id=None,
+    sheet_title="AWS Cost Analyzer",
+    share_with=None,
+):
+    sheets_service, drive_service = _get_services(gcp_key_path)
+
+    if not sheet_id:
+        sheet_id = create_google_sheet(gcp_key_path, sheet_title)
+
+    # Every (sheet_tab, rows, clear_existing) entry goes into a single
+    # spreadsheets.batchUpdate request: an optional updateCells clear of the
+    # whole tab followed by a paste of the new rows.
+    requests = []
+    for sheet_tab, rows, clear_existing in tabs:
+        _, tab_id = ensure_sheet_tab(sheets_service, sheet_id, sheet_tab)
+
+        if clear_existing:
+            requests.append(
+                {
+                    "updateCells": {
+                        "range": {"sheetId": tab_id},
+                        "fields": "userEnteredValue",
+                    }
+                }
+            )
+        requests.append(
+            {
+                "pasteData": {
+                    "coordinate": {
+                        "sheetId": tab_id,
+                        "rowIndex": 0,
+                        "columnIndex": 0,
+                    },
+                    "data": paste_text(rows),
+                    "delimiter": "\t",
+                    "type": "PASTE_NORMAL",
+                }
+            }
+        )
+
+    sheets_service.spreadsheets().batchUpdate(
+        spreadsheetId=sheet_id,
+        body={"requests": requests},
+    ).execute()
+
+    if share_with:
+        share_sheet(drive_service, sheet_id, share_with)
+
+    return sheet_id, f"https://docs.google.com/spreadsheets/d/{sheet_id}"
+
+
+def create_google_sheet(gcp_key_path, sheet_title):
+    sheets_service, _ = _get_services(gcp_key_path)
+    spreadsheet = (
+        sheets_service.spreadsheets()
+        .create(body={"properties": {"title": sheet_title}})
+        .execute()
+    )
+    return spreadsheet.get("spreadsheetId")
+
+
+def share_sheet(drive_service, sheet_id, share_with):
+    if isinstance(share_with, str):
+        share_with = [share_with]
+
+    # Uploads to several tabs of the same sheet share it with the same
+    # people, so only grant each permission once per process.
+    emails = [
+        email for email in share_with if (sheet_id, email) not in _shared
+    ]
+    if not emails:
+        return
+
+    def raise_on_error(request_id, response, exception):
+        if exception is not None:
+            raise exception
+
+    batch = drive_service.new_batch_http_request(callback=raise_on_error)
+    for email in emails:
+        batch.add(
+            drive_service.permissions().create(
+                fileId=sheet_id,
+                body={"type": "user", "role": "writer", "emailAddress": email},
+                sendNotificationEmail=True,
+            )
+        )
+    batch.execute()
+
+    _shared.update((sheet_id, email) for email in emails)
+
+
+def ensure_sheet_tab(sheets_service, sheet_id, sheet_tab):
+    if not sheet_tab:
+        sheet_tab = "Sheet1"
+
+    # Look the spreadsheet's tabs up once per process; later uploads to the
+    # same sheet are answered from the cache.
+    tabs = _sheet_tabs.get(sheet_id)
+    if tabs is None:
+        spreadsheet = sheets_service.spreadsheets().get(
+            spreadsheetId=sheet_id,
+            fields="sheets(properties(sheetId,title))",
+        ).execute()
+        tabs = {}
+        for sheet in spreadsheet.get("sheets", []):
+            properties = sheet.get("properties", {})
+            tabs[properties.get("title")] = properties.get("sheetId")
+        _sheet_tabs[sheet_id] = tabs
+
+    if sheet_tab in tabs:
+        return sheet_tab, tabs[sheet_tab]
+
+    response = sheets_service.spreadsheets().batchUpdate(
+        spreadsheetId=sheet_id,
+        body={"requests": [{"addSheet": {"properties": {"title": sheet_tab}}}]},
+    ).execute()
+    tabs[sheet_tab] = response["replies"][0]["addSheet"]["properties"]["sheetId"]
+
+    return sheet_tab, tabs[sheet_tab]
+
+
+def paste_text(rows):
+    # pasteData parses each cell as if typed in, like USER_ENTERED. Cells
+    # are tab-delimited, so tabs and line breaks inside values become spaces.
+    cleanup = str.maketrans("\t\r\n", "   ")
+    return "\n".join(
+        "\t".join(str(value).translate(cleanup) for value in row) for row in rows
+    )
+
+
+def read_json(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def write_json(path, payload):
+    if orjson is not None:
+        data = orjson.dumps(
+            payload, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE
+        )
+    else:
+        data = (json.dumps(payload, indent=2) + "\n").encode("utf-8")
+
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def load_sheet_config(explicit_sheet_id, explicit_sheet_tab, sheet_config_path):
+    sheet_id = explicit_sheet_id or ""
+    sheet_tab = explicit_sheet_tab or ""
+
+    if sheet_config_path and os.path.exists(sheet_config_path):
+        config = read_json(sheet_config_path)
+        if not sheet_id:
+            sheet_id = config.get("sheet_id", "").strip()
+        if not sheet_tab:
+            sheet_tab = config.get("sheet_tab", "").strip()
+        if not sheet_id and not sheet_tab:
+            print(
+                f"Warning: {sheet_config_path} is empty. "
+                "Provide a sheet_id or sheet_tab, or pass flags explicitly.",
+                file=sys.stderr,
+            )
+    elif sheet_config_path:
+        print(
+            f"Warning: sheet config file not found: {sheet_config_path}",
+            file=sys.stderr,
+        )
+
+    if not sheet_tab:
+        sheet_tab = "Sheet1"
+
+    return sheet_id, sheet_tab
+
+
+def store_sheet_config(sheet_config_path, sheet_id, sheet_tab):
+    if not sheet_config_path:
+        return
+
+    payload = {}
+    if sheet_id:
+        payload["sheet_id"] = sheet_id
+    if sheet_tab:
+        payload["sheet_tab"] = sheet_tab
+    write_json(sheet_config_path, payload)
@@ -1,17 +1,39 @@
 #!/usr/bin/env python3
 import argparse
 import csv
-import json
 import os
-import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta, timezone
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 
+import cost_by_account
+import cost_by_service
+from common import (
+    COST_CSV_HEADER,
+    create_google_sheet,
+    load_sheet_config,
+    read_json,
+    upload_tabs_to_google_sheet,
+    write_json,
+)
+
+MAX_ACCOUNT_WORKERS = 16
+# Kept small because Cost Explorer's per-account request rate is low and
+# each account already runs on its own worker.
+MAX_MONTH_WORKERS = 4
+CSV_BUFFER_SIZE = 1 << 20
+
+# Shared by every boto3 client. The pool is sized for the parallel month
+# fetches in fetch_costs, which all go through one Cost Explorer client.
+AWS_CLIENT_CONFIG = Config(
+    retries={"max_attempts": 3, "mode": "adaptive"},
+    tcp_keepalive=True,
+    max_pool_connections=MAX_MONTH_WORKERS,
+)
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -82,7 +104,11 @@ def parse_args():
     )
     parser.add_argument(
         "--share-with",
-        help="Email address to grant edit access to the Google Sheet.",
+        action="append",
+        help=(
+            "Email address to grant edit access to the Google Sheet "
+            "(repeat to share with several people)."
+        ),
     )
     return parser.parse_args()
 
@@ -103,16 +129,15 @@ def default_dates(start_str, end_str):
 
 
 def load_aws_accounts(config_path):
-    if not os.path.exists(config_path):
+    try:
+        config = read_json(config_path)
+    except FileNotFoundError:
         print(
             f"Error: AWS accounts config file not found: {config_path}",
             file=sys.stderr,
         )
         sys.exit(1)
 
-    with open(config_path, "r", encoding="utf-8") as f:
-        config = json.load(f)
-
     return config.get("accounts", [])
 
 
@@ -135,156 +160,97 @@ def get_account_info(iam_client, sts_client):
     return account_id, account_name
 
 
-def upload_csv_to_google_sheet(
-    csv_path,
-    gcp_key_path,
-    sheet_id=None,
-    sheet_title="AWS Cost Analyzer",
-    sheet_tab="Sheet1",
-    share_with=None,
-):
-    scopes = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive",
-    ]
-    credentials = service_account.Credentials.from_service_account_file(
-        gcp_key_path, scopes=scopes
-    )
-    sheets_service = build("sheets", "v4", credentials=credentials)
-    drive_service = build("drive", "v3", credentials=credentials)
-
-    if not sheet_id:
-        spreadsheet = (
-            sheets_service.spreadsheets()
-            .create(body={"properties": {"title": sheet_title}})
-            .execute()
-        )
-        sheet_id = spreadsheet.get("spreadsheetId")
-
-    sheet_tab = ensure_sheet_tab(sheets_service, sheet_id, sheet_tab)
-
-    with open(csv_path, "r", encoding="utf-8") as csvfile:
-        rows = list(csv.reader(csvfile))
-
-    sheets_service.spreadsheets().values().clear(
-        spreadsheetId=sheet_id,
-        range=sheet_tab,
-    ).execute()
-
-    (
-        sheets_service.spreadsheets()
-        .values()
-        .update(
-            spreadsheetId=sheet_id,
-            range=f"{sheet_tab}!A1",
-            valueInputOption="USER_ENTERED",
-            body={"values": rows},
-        )
-        .execute()
+def resolve_account_info(session, account_config, account_cache):
+    if "account_id" in account_config and "account_name" in account_config:
+        return account_config["account_id"], account_config["account_name"]
+
+    aws_access_key_id = account_config.get("aws_access_key_id")
+    if account_cache is not None and aws_access_key_id in account_cache:
+        cached = account_cache[aws_access_key_id]
+        return cached.get("account_id", ""), cached.get("account_name", "")
+
+    account_id, account_name = get_account_info(
+        session.client("iam", config=AWS_CLIENT_CONFIG),
+        session.client("sts", config=AWS_CLIENT_CONFIG),
     )
+    if account_id and account_cache is not None:
+        account_cache[aws_access_key_id] = {
+            "account_id": account_id,
+            "account_name": account_name,
+        }
 
-    if share_with:
-        drive_service.permissions().create(
-            fileId=sheet_id,
-            body={"type": "user", "role": "writer", "emailAddress": share_with},
-            sendNotificationEmail=True,
-        ).execute()
-
-    return sheet_id, f"https://docs.google.com/spreadsheets/d/{sheet_id}"
-
-
-def ensure_sheet_tab(sheets_service, sheet_id, sheet_tab):
-    if not sheet_tab:
-        sheet_tab = "Sheet1"
-
-    spreadsheet = sheets_service.spreadsheets().get(
-        spreadsheetId=sheet_id,
-        fields="sheets(properties(sheetId,title))",
-    ).execute()
-    for sheet in spreadsheet.get("sheets", []):
-        title = sheet.get("properties", {}).get("title")
-        if title == sheet_tab:
-            return sheet_tab
-
-    sheets_service.spreadsheets().batchUpdate(
-        spreadsheetId=sheet_id,
-        body={"requests": [{"addSheet": {"properties": {"title": sheet_tab}}}]},
-    ).execute()
-
-    return sheet_tab
-
-
-def load_sheet_config(explicit_sheet_id, explicit_sheet_tab, sheet_config_path):
-    sheet_id = explicit_sheet_id or ""
-    sheet_tab = explicit_sheet_tab or ""
-
-    if sheet_config_path and os.path.exists(sheet_config_path):
-        with open(sheet_config_path, "r", encoding="utf-8") as f:
-            config = json.load(f)
-        if not sheet_id:
-            sheet_id = config.get("sheet_id", "").strip()
-        if not sheet_tab:
-            sheet_tab = config.get("sheet_tab", "").strip()
-        if not sheet_id and not sheet_tab:
-            print(
-                f"Warning: {sheet_config_path} is empty. "
-                "Provide a sheet_id or sheet_tab, or pass flags explicitly.",
-                file=sys.stderr,
-            )
-    elif sheet_config_path:
-        print(
-            f"Warning: sheet config file not found: {sheet_config_path}",
-            file=sys.stderr,
-        )
+    return account_id, account_name
 
-    if not sheet_tab:
-        sheet_tab = "Sheet1"
 
-    return sheet_id, sheet_tab
+def account_cache_path(config_path):
+    return f"{os.path.splitext(config_path)[0]}.cache.json"
 
 
-def store_sheet_config(sheet_config_path, sheet_id, sheet_tab):
-    if not sheet_config_path:
-        return
+def load_account_cache(cache_path):
+    try:
+        return read_json(cache_path)
+    except FileNotFoundError:
+        return {}
 
-    with open(sheet_config_path, "w", encoding="utf-8") as f:
-        payload = {}
-        if sheet_id:
-            payload["sheet_id"] = sheet_id
-        if sheet_tab:
-            payload["sheet_tab"] = sheet_tab
-        json.dump(payload, f, indent=2)
-        f.write("\n")
 
+def store_account_cache(cache_path, account_cache):
+    write_json(cache_path, account_cache)
 
-def fetch_costs(
+
+def month_ranges(start_date, end_date):
+    start = date.fromisoformat(start_date)
+    end = date.fromisoformat(end_date)
+
+    ranges = []
+    while start < end:
+        if start.month == 12:
+            next_month = date(start.year + 1, 1, 1)
+        else:
+            next_month = date(start.year, start.month + 1, 1)
+        chunk_end = min(next_month, end)
+        ranges.append((start.isoformat(), chunk_end.isoformat()))
+        start = chunk_end
+
+    return ranges
+
+
+def fetch_cost_range(
     ce_client,
     start_date,
     end_date,
     granularity,
     group_by,
+    linked_account=False,
+    account_names=None,
 ):
-    request = {
-        "TimePeriod": {"Start": start_date, "End": end_date},
-        "Granularity": granularity,
-        "Metrics": ["UnblendedCost"],
-    }
-
+    group_keys = []
+    if linked_account:
+        group_keys.append("LINKED_ACCOUNT")
     if group_by == "SERVICE":
-        request["GroupBy"] = [
-            {"Type": "DIMENSION", "Key": "SERVICE"}
-        ]
+        group_keys.append("SERVICE")
 
     results = []
     next_token = None
     while True:
+        request = {
+            "TimePeriod": {"Start": start_date, "End": end_date},
+            "Granularity": granularity,
+            "Metrics": ["UnblendedCost"],
+        }
+        if group_keys:
+            request["GroupBy"] = [
+                {"Type": "DIMENSION", "Key": key} for key in group_keys
+            ]
         if next_token:
             request["NextPageToken"] = next_token
-        elif "NextPageToken" in request:
-            del request["NextPageToken"]
 
         response = ce_client.get_cost_and_usage(**request)
         results.extend(response.get("ResultsByTime", []))
+        if account_names is not None:
+            for attribute in response.get("DimensionValueAttributes", []):
+                account_names[attribute.get("Value", "")] = attribute.get(
+                    "Attributes", {}
+                ).get("description", "")
         next_token = response.get("NextPageToken")
         if not next_token:
             break
@@ -292,7 +258,58 @@ def fetch_costs(
     return results
 
 
-def process_account(account_config, region, start_date, end_date, granularity, group_by):
+def fetch_costs(
+    ce_client,
+    start_date,
+    end_date,
+    granularity,
+    group_by,
+    linked_account=False,
+    account_names=None,
+):
+    # Cost Explorer has no paginator, so split the range on month boundaries
+    # and page through each month in parallel.
+    ranges = month_ranges(start_date, end_date)
+    if len(ranges) <= 1:
+        return fetch_cost_range(
+            ce_client,
+            start_date,
+            end_date,
+            granularity,
+            group_by,
+            linked_account,
+            account_names,
+        )
+
+    with ThreadPoolExecutor(
+        max_workers=min(MAX_MONTH_WORKERS, len(ranges))
+    ) as executor:
+        chunks = executor.map(
+            lambda date_range: fetch_cost_range(
+                ce_client,
+                *date_range,
+                granularity,
+                group_by,
+                linked_account,
+                account_names,
+            ),
+            ranges,
+        )
+        results = [period for chunk in chunks for period in chunk]
+
+    results.sort(key=lambda period: period.get("TimePeriod", {}).get("Start", ""))
+    return results
+
+
+def process_account(
+    account_config,
+    region,
+    start_date,
+    end_date,
+    granularity,
+    group_by,
+    account_cache=None,
+):
     aws_access_key_id = account_config.get("aws_access_key_id")
     aws_secret_access_key = account_config.get("aws_secret_access_key")
     account_region = account_config.get("region", region)
@@ -307,11 +324,16 @@ def process_account(account_config, region, start_date, end_date, granularity, g
         region_name=account_region,
     )
 
-    ce_client = session.client("ce", region_name=region)
-    iam_client = session.client("iam")
-    sts_client = session.client("sts")
+    ce_client = session.client("ce", region_name=region, config=AWS_CLIENT_CONFIG)
+
+    if account_config.get("payer"):
+        return process_linked_accounts(
+            ce_client, start_date, end_date, granularity, group_by
+        )
 
-    account_id, account_name = get_account_info(iam_client, sts_client)
+    account_id, account_name = resolve_account_info(
+        session, account_config, account_cache
+    )
 
     results = fetch_costs(
         ce_client,
@@ -325,6 +347,7 @@ def process_account(account_config, region, start_date, end_date, granularity, g
     for period in results:
         period_start = period.get("TimePeriod", {}).get("Start", "")
         period_end = period.get("TimePeriod", {}).get("End", "")
+        prefix = (account_id, account_name, period_start, period_end, granularity)
 
         if group_by == "SERVICE":
             for group in period.get("Groups", []):
@@ -333,37 +356,60 @@ def process_account(account_config, region, start_date, end_date, granularity, g
                 metric = group.get("Metrics", {}).get("UnblendedCost", {})
                 amount = metric.get("Amount", "0")
                 unit = metric.get("Unit", "USD")
-                rows.append(
-                    [
-                        account_id,
-                        account_name,
-                        period_start,
-                        period_end,
-                        granularity,
-                        service_name,
-                        amount,
-                        unit,
-                    ]
-                )
+                rows.append((*prefix, service_name, amount, unit))
         else:
             metric = period.get("Total", {}).get("UnblendedCost", {})
             amount = metric.get("Amount", "0")
             unit = metric.get("Unit", "USD")
+            rows.append((*prefix, "", amount, unit))
+
+    print(
+        f"Fetched {len(rows)} rows for account {account_id or 'unknown'} ({account_name or 'no-alias'})"
+    )
+    return rows
+
+
+def process_linked_accounts(ce_client, start_date, end_date, granularity, group_by):
+    # A payer (management) account sees every linked account's costs, so one
+    # Cost Explorer query grouped by LINKED_ACCOUNT covers the organization.
+    account_names = {}
+    results = fetch_costs(
+        ce_client,
+        start_date,
+        end_date,
+        granularity,
+        group_by,
+        linked_account=True,
+        account_names=account_names,
+    )
+
+    rows = []
+    for period in results:
+        period_start = period.get("TimePeriod", {}).get("Start", "")
+        period_end = period.get("TimePeriod", {}).get("End", "")
+        period_fields = (period_start, period_end, granularity)
+
+        for group in period.get("Groups", []):
+            keys = group.get("Keys", [])
+            account_id = keys[0] if keys else ""
+            service_name = keys[1] if len(keys) > 1 else ""
+            metric = group.get("Metrics", {}).get("UnblendedCost", {})
+            amount = metric.get("Amount", "0")
+            unit = metric.get("Unit", "USD")
             rows.append(
-                [
+                (
                     account_id,
-                    account_name,
-                    period_start,
-                    period_end,
-                    granularity,
-                    "",
+                    account_names.get(account_id, ""),
+                    *period_fields,
+                    service_name,
                     amount,
                     unit,
-                ]
+                )
             )
 
     print(
-        f"Fetched {len(rows)} rows for account {account_id or 'unknown'} ({account_name or 'no-alias'})"
+        f"Fetched {len(rows)} rows for {len(account_names)} linked accounts "
+        "via the payer account"
     )
     return rows
 
@@ -381,101 +427,143 @@ def main():
         print("Error: No AWS accounts configured in config file", file=sys.stderr)
         sys.exit(1)
 
-    total_rows = 0
-    with open(args.output, "w", newline="", encoding="utf-8") as csvfile:
+    # With a payer account configured, its single LINKED_ACCOUNT query
+    # replaces the per-account fetches.
+    payer_account = next(
+        (account for account in accounts if account.get("payer")), None
+    )
+    if payer_account is not None:
+        accounts = [payer_account]
+
+    cache_path = account_cache_path(args.config)
+    account_cache = load_account_cache(cache_path)
+    cached_accounts = dict(account_cache)
+
+    rows = []
+    with open(
+        args.output,
+        "w",
+        newline="",
+        encoding="utf-8",
+        buffering=CSV_BUFFER_SIZE,
+    ) as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(
-            [
-                "account_id",
-                "account_name",
-                "period_start",
-                "period_end",
-                "granularity",
-                "service",
-                "amount",
-                "unit",
+        writer.writerow(COST_CSV_HEADER)
+
+        # Each worker builds its own boto3 Session inside process_account, so
+        # accounts can be fetched concurrently. Rows are written from the main
+        # thread only, since csv.writer is not thread-safe. The rows are kept
+        # for the summary tabs and the upload.
+        with ThreadPoolExecutor(max_workers=MAX_ACCOUNT_WORKERS) as executor:
+            futures = [
+                executor.submit(
+                    process_account,
+                    account_config,
+                    args.region,
+                    start_date,
+                    end_date,
+                    args.granularity,
+                    args.group_by,
+                    account_cache,
+                )
+                for account_config in accounts
             ]
-        )
+            try:
+                for future in futures:
+                    account_rows = future.result()
+                    writer.writerows(account_rows)
+                    rows.extend(account_rows)
+            except BaseException:
+                # Drop accounts that have not started so the error is not
+                # held up behind the rest of the fetches.
+                executor.shutdown(cancel_futures=True)
+                raise
+
+    if account_cache != cached_accounts:
+        store_account_cache(cache_path, account_cache)
+
+    total_rows = len(rows)
+    print(f"Wrote {total_rows} rows to {args.output}")
 
-        for account_config in accounts:
-            rows = process_account(
-                account_config,
-                args.region,
-                start_date,
-                end_date,
-                args.granularity,
-                args.group_by,
-            )
-            for row in rows:
-                writer.writerow(row)
-            total_rows += len(rows)
+    upload_enabled = bool(args.gcp_key and os.path.exists(args.gcp_key))
+    if upload_enabled and not sheet_id:
+        # Create the sheet now so the summary tabs land in it too.
+        sheet_id = create_google_sheet(args.gcp_key, args.sheet_title)
 
-    print(f"Wrote {total_rows} rows to {args.output}")
+    summary_options = {
+        "input": args.output,
+        "gcp_key": args.gcp_key,
+        "sheet_id": sheet_id,
+        "sheet_config": args.sheet_config,
+    }
+    cost_by_service.run(
+        argparse.Namespace(
+            output="cost_by_service.csv",
+            sheet_tab="cost_by_service",
+            **summary_options,
+        ),
+        rows=rows,
+    )
+    cost_by_account.run(
+        argparse.Namespace(
+            output="cost_by_account.csv",
+            sheet_tab="cost_by_account",
+            **summary_options,
+        ),
+        rows=rows,
+    )
 
-    if args.gcp_key and os.path.exists(args.gcp_key):
-        sheet_id, sheet_url = upload_csv_to_google_sheet(
-            args.output,
+    logs_path = "logs.csv"
+    run_finished_at = datetime.now(timezone.utc)
+    log_rows = [
+        [
+            "run_started_at_utc",
+            "run_finished_at_utc",
+            "data_start_date",
+            "data_end_date",
+            "granularity",
+            "group_by",
+            "rows_written",
+        ],
+        [
+            run_started_at.isoformat(),
+            run_finished_at.isoformat(),
+            start_date,
+            end_date,
+            args.granularity,
+            args.group_by,
+            total_rows,
+        ],
+    ]
+    with open(
+        logs_path,
+        "w",
+        newline="",
+        encoding="utf-8",
+        buffering=CSV_BUFFER_SIZE,
+    ) as csvfile:
+        csv.writer(csvfile).writerows(log_rows)
+
+    if upload_enabled:
+        # The cost data and logs tabs are cleared and pasted in one
+        # spreadsheets.batchUpdate request (updateCells + pasteData).
+        _, sheet_url = upload_tabs_to_google_sheet(
             args.gcp_key,
+            [
+                (sheet_tab, [COST_CSV_HEADER, *rows], True),
+                ("logs", log_rows, False),
+            ],
             sheet_id=sheet_id,
             sheet_title=args.sheet_title,
-            sheet_tab=sheet_tab,
             share_with=args.share_with,
         )
-        print(f"Uploaded to Google Sheet: {sheet_url}")
+        print(f"Uploaded data and logs to Google Sheet: {sheet_url}")
     else:
         print(
             "Google Sheets upload skipped (missing key file). "
             "Provide --gcp-key or place key.json in the project directory."
         )
 
-    result = subprocess.run([sys.executable, "cost_by_service.py"], check=False)
-    if result.returncode != 0:
-        print("Error: cost_by_service.py failed.", file=sys.stderr)
-        sys.exit(result.returncode)
-
-    result = subprocess.run([sys.executable, "cost_by_account.py"], check=False)
-    if result.returncode != 0:
-        print("Error: cost_by_account.py failed.", file=sys.stderr)
-        sys.exit(result.returncode)
-
-    logs_path = "logs.csv"
-    run_finished_at = datetime.now(timezone.utc)
-    with open(logs_path, "w", newline="", encoding="utf-8") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(
-            [
-                "run_started_at_utc",
-                "run_finished_at_utc",
-                "data_start_date",
-                "data_end_date",
-                "granularity",
-                "group_by",
-                "rows_written",
-            ]
-        )
-        writer.writerow(
-            [
-                run_started_at.isoformat(),
-                run_finished_at.isoformat(),
-                start_date,
-                end_date,
-                args.granularity,
-                args.group_by,
-                total_rows,
-            ]
-        )
-
-    if args.gcp_key and os.path.exists(args.gcp_key):
-        _, sheet_url = upload_csv_to_google_sheet(
-            logs_path,
-            args.gcp_key,
-            sheet_id=sheet_id,
-            sheet_title=args.sheet_title,
-            sheet_tab="logs",
-            share_with=args.share_with,
-        )
-        print(f"Uploaded logs to Google Sheet: {sheet_url}")
-
 
 if __name__ == "__main__":
     main()
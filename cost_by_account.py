@@ -3,13 +3,19 @@ import argparse
 import csv
 import os
 import sys
+from collections import defaultdict
+from operator import itemgetter
 
-from cost_analyzer import (
+from common import (
+    COST_CSV_HEADER,
     load_sheet_config,
     store_sheet_config,
     upload_csv_to_google_sheet,
 )
 
+# Columns read from aws_costs.csv, looked up by header name.
+SUMMARY_COLUMNS = ("account_id", "account_name", "amount", "unit")
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -30,6 +36,11 @@ def parse_args():
         default="key.json",
         help="Path to Google service account JSON key file.",
     )
+    parser.add_argument(
+        "--sheet-id",
+        default="",
+        help="Google Sheet ID to update (default: read from --sheet-config).",
+    )
     parser.add_argument(
         "--sheet-config",
         default="sheet_config.json",
@@ -48,47 +59,75 @@ def load_costs(input_path):
         print(f"Error: Input CSV not found: {input_path}", file=sys.stderr)
         sys.exit(1)
 
-    totals = {}
+    with open(input_path, "r", newline="", encoding="utf-8") as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, None)
+        if header is None:
+            return {}, "USD"
+        try:
+            indices = column_indices(header)
+        except ValueError as exc:
+            print(
+                f"Error: Unexpected columns in {input_path}: {exc}",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        return aggregate(reader, indices)
+
+
+def column_indices(header):
+    return tuple(header.index(column) for column in SUMMARY_COLUMNS)
+
+
+def aggregate(rows, indices=None):
+    # Rows passed in from cost_analyzer follow COST_CSV_HEADER.
+    indices = indices or column_indices(COST_CSV_HEADER)
+    account_id_index, account_name_index, amount_index, unit_index = indices
+    last_index = max(indices)
+    totals = defaultdict(float)
     unit = "USD"
 
-    with open(input_path, "r", newline="", encoding="utf-8") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            account_id = (row.get("account_id") or "").strip()
-            account_name = (row.get("account_name") or "").strip()
-            key = (account_id, account_name)
-            amount_str = (row.get("amount") or "0").strip()
-            row_unit = (row.get("unit") or "").strip()
-            if row_unit:
-                unit = row_unit
-
-            try:
-                amount = float(amount_str)
-            except ValueError:
-                amount = 0.0
-
-            totals[key] = totals.get(key, 0.0) + amount
+    for row in rows:
+        # Skip blank lines, which csv.reader yields as [], and treat missing
+        # trailing fields as empty, as DictReader did.
+        if not row:
+            continue
+        if len(row) <= last_index:
+            row = [*row, *[""] * (last_index + 1 - len(row))]
+
+        row_unit = row[unit_index]
+        if row_unit:
+            unit = row_unit
+
+        try:
+            amount = float(row[amount_index] or 0)
+        except ValueError:
+            amount = 0.0
+
+        totals[(row[account_id_index], row[account_name_index])] += amount
 
     return totals, unit
 
 
 def write_summary(output_path, totals, unit):
-    sorted_rows = sorted(
-        totals.items(), key=lambda item: item[1], reverse=True
-    )
+    sorted_rows = sorted(totals.items(), key=itemgetter(1), reverse=True)
     currency_prefix = "$" if unit == "USD" else ""
+    formatted_rows = [
+        (account_id, account_name, f"{currency_prefix}{amount:,.2f}", unit)
+        for (account_id, account_name), amount in sorted_rows
+    ]
 
     with open(output_path, "w", newline="", encoding="utf-8") as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["account_id", "account_name", "total_amount", "unit"])
-        for (account_id, account_name), amount in sorted_rows:
-            formatted_amount = f"{currency_prefix}{amount:,.2f}"
-            writer.writerow([account_id, account_name, formatted_amount, unit])
+        writer.writerows(formatted_rows)
 
 
-def main():
-    args = parse_args()
-    totals, unit = load_costs(args.input)
+def run(args, rows=None):
+    if rows is None:
+        totals, unit = load_costs(args.input)
+    else:
+        totals, unit = aggregate(rows)
 
     if not totals:
         print("No cost data found to aggregate.")
@@ -97,7 +136,9 @@ def main():
     write_summary(args.output, totals, unit)
     print(f"Wrote cost summary to {args.output}")
 
-    sheet_id, sheet_tab = load_sheet_config("", args.sheet_tab, args.sheet_config)
+    sheet_id, sheet_tab = load_sheet_config(
+        args.sheet_id, args.sheet_tab, args.sheet_config
+    )
 
     if args.gcp_key and os.path.exists(args.gcp_key):
         sheet_id, sheet_url = upload_csv_to_google_sheet(
@@ -115,4 +156,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    run(parse_args())
@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 import argparse
 import csv
+import mmap
+import multiprocessing
 import os
 import sys
+from collections import Counter, defaultdict
+from operator import itemgetter
 
-from cost_analyzer import (
+from common import (
+    COST_CSV_HEADER,
     load_sheet_config,
     store_sheet_config,
     upload_csv_to_google_sheet,
 )
 
+# Columns read from aws_costs.csv, looked up by header name.
+SUMMARY_COLUMNS = ("service", "amount", "unit")
+
+# Inputs at least this large are aggregated in parallel, one chunk of
+# roughly CHUNK_BYTES per worker task.
+PARALLEL_MIN_BYTES = 256 << 20
+CHUNK_BYTES = 64 << 20
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -30,6 +43,11 @@ def parse_args():
         default="key.json",
         help="Path to Google service account JSON key file.",
     )
+    parser.add_argument(
+        "--sheet-id",
+        default="",
+        help="Google Sheet ID to update (default: read from --sheet-config).",
+    )
     parser.add_argument(
         "--sheet-config",
         default="sheet_config.json",
@@ -48,46 +66,166 @@ def load_costs(input_path):
         print(f"Error: Input CSV not found: {input_path}", file=sys.stderr)
         sys.exit(1)
 
-    totals = {}
-    unit = "USD"
+    with open(input_path, "r", newline="", encoding="utf-8") as csvfile:
+        header = next(csv.reader(csvfile), None)
+    if header is None:
+        return {}, "USD"
+
+    # Every path below reads the same columns, so check them once here.
+    try:
+        indices = column_indices(header)
+    except ValueError as exc:
+        print(f"Error: Unexpected columns in {input_path}: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    if os.path.getsize(input_path) >= PARALLEL_MIN_BYTES:
+        return load_costs_parallel(input_path, indices)
+
+    # pandas is optional and only needed here, so it is imported lazily to
+    # keep it out of in-process callers of aggregate().
+    try:
+        import pandas
+    except ImportError:
+        pandas = None
+    if pandas is not None:
+        return load_costs_with_pandas(pandas, input_path)
 
     with open(input_path, "r", newline="", encoding="utf-8") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            service = (row.get("service") or "").strip() or "Uncategorized"
-            amount_str = (row.get("amount") or "0").strip()
-            row_unit = (row.get("unit") or "").strip()
-            if row_unit:
-                unit = row_unit
+        reader = csv.reader(csvfile)
+        next(reader, None)
+        return aggregate(reader, indices)
+
+
+def column_indices(header):
+    return tuple(header.index(column) for column in SUMMARY_COLUMNS)
+
+
+def load_costs_parallel(input_path, indices):
+    with open(input_path, "rb") as csvfile, mmap.mmap(
+        csvfile.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        offsets = chunk_offsets(mapped)
+
+    # Workers read their own byte range from disk rather than receiving the
+    # chunk contents through a pipe.
+    with multiprocessing.Pool() as pool:
+        partials = pool.starmap(
+            aggregate_chunk,
+            [
+                (input_path, start, end, indices)
+                for start, end in zip(offsets, offsets[1:])
+            ],
+        )
+
+    # Counter.update keeps negative totals (credits), unlike Counter.__add__.
+    totals = Counter()
+    unit = "USD"
+    for partial_totals, partial_unit in partials:
+        totals.update(partial_totals)
+        if partial_unit is not None:
+            unit = partial_unit
+
+    return dict(totals), unit
+
 
-            try:
-                amount = float(amount_str)
-            except ValueError:
-                amount = 0.0
+def chunk_offsets(mapped):
+    # Start after the header row and end every chunk on a newline. Fields
+    # in aws_costs.csv never contain embedded newlines.
+    offsets = [mapped.find(b"\n") + 1]
+    size = len(mapped)
+    while offsets[-1] < size:
+        newline = mapped.find(b"\n", offsets[-1] + CHUNK_BYTES)
+        offsets.append(size if newline == -1 else newline + 1)
+    return offsets
 
-            totals[service] = totals.get(service, 0.0) + amount
+
+def aggregate_chunk(input_path, start, end, indices):
+    with open(input_path, "rb") as csvfile:
+        csvfile.seek(start)
+        text = csvfile.read(end - start).decode("utf-8")
+
+    # A chunk without any unit reports None so it cannot override a unit
+    # seen in an earlier chunk.
+    totals, unit = aggregate(
+        csv.reader(text.splitlines()), indices, default_unit=None
+    )
+    return dict(totals), unit
+
+
+def load_costs_with_pandas(pandas, input_path):
+    # Match the csv.reader path: keep service names such as "NA" literal,
+    # count unparseable amounts as 0, and treat an empty file as no data.
+    try:
+        frame = pandas.read_csv(
+            input_path,
+            usecols=list(SUMMARY_COLUMNS),
+            dtype=str,
+            keep_default_na=False,
+        )
+    except pandas.errors.EmptyDataError:
+        return {}, "USD"
+
+    frame["service"] = frame["service"].replace("", "Uncategorized")
+    amounts = pandas.to_numeric(frame["amount"], errors="coerce")
+    frame["amount"] = amounts.fillna(0.0)
+
+    totals = frame.groupby("service", sort=False)["amount"].sum().to_dict()
+    units = frame["unit"][frame["unit"] != ""]
+    unit = units.iloc[-1] if not units.empty else "USD"
+
+    return totals, unit
+
+
+def aggregate(rows, indices=None, default_unit="USD"):
+    # Rows passed in from cost_analyzer follow COST_CSV_HEADER.
+    indices = indices or column_indices(COST_CSV_HEADER)
+    service_index, amount_index, unit_index = indices
+    last_index = max(indices)
+    totals = defaultdict(float)
+    unit = default_unit
+
+    for row in rows:
+        # Skip blank lines, which csv.reader yields as [], and treat missing
+        # trailing fields as empty, as DictReader did.
+        if not row:
+            continue
+        if len(row) <= last_index:
+            row = [*row, *[""] * (last_index + 1 - len(row))]
+
+        row_unit = row[unit_index]
+        if row_unit:
+            unit = row_unit
+
+        try:
+            amount = float(row[amount_index] or 0)
+        except ValueError:
+            amount = 0.0
+
+        totals[row[service_index] or "Uncategorized"] += amount
 
     return totals, unit
 
 
 def write_summary(output_path, totals, unit):
-    sorted_rows = sorted(
-        totals.items(), key=lambda item: item[1], reverse=True
-    )
+    sorted_rows = sorted(totals.items(), key=itemgetter(1), reverse=True)
 
     currency_prefix = "$" if unit == "USD" else ""
+    formatted_rows = [
+        (service, f"{currency_prefix}{amount:,.2f}", unit)
+        for service, amount in sorted_rows
+    ]
 
     with open(output_path, "w", newline="", encoding="utf-8") as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["service", "total_amount", "unit"])
-        for service, amount in sorted_rows:
-            formatted_amount = f"{currency_prefix}{amount:,.2f}"
-            writer.writerow([service, formatted_amount, unit])
+        writer.writerows(formatted_rows)
 
 
-def main():
-    args = parse_args()
-    totals, unit = load_costs(args.input)
+def run(args, rows=None):
+    if rows is None:
+        totals, unit = load_costs(args.input)
+    else:
+        totals, unit = aggregate(rows)
 
     if not totals:
         print("No cost data found to aggregate.")
@@ -96,7 +234,9 @@ def main():
     write_summary(args.output, totals, unit)
     print(f"Wrote cost summary to {args.output}")
 
-    sheet_id, sheet_tab = load_sheet_config("", args.sheet_tab, args.sheet_config)
+    sheet_id, sheet_tab = load_sheet_config(
+        args.sheet_id, args.sheet_tab, args.sheet_config
+    )
 
     if args.gcp_key and os.path.exists(args.gcp_key):
         sheet_id, sheet_url = upload_csv_to_google_sheet(
@@ -114,4 +254,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    run(parse_args())